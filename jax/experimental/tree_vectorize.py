@@ -0,0 +1,1085 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An experimental prototype for writing array-oriented code over pytrees.
+
+``tree_vectorize`` traces a function written in terms of standard
+:mod:`jax.numpy` operations, but feeds it "tree vectors": pytrees of arrays
+that together stand in for a single logical one-dimensional array. Tree
+structure is propagated through primitives leaf-by-leaf, so, for example,
+``jnp.dot(x, x)`` on a tree vector computes the sum of per-leaf dot products
+without ever concatenating the leaves into one array.
+
+Internally, each logical dimension of a traced value is either "trivial"
+(an ordinary array dimension) or expanded over the leaves of a treedef.
+A :class:`TreeTracer` stores one treedef per logical dimension, the array
+shape contributed by each leaf along each dimension, and a dict mapping
+per-dimension leaf coordinates to array blocks.
+
+This module is a prototype: only a subset of primitives have tree rules, and
+error handling is rudimentary.
+"""
+
+import collections
+import functools
+from functools import partial
+import itertools as it
+import operator
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+import jax
+from jax import core
+from jax import lax
+import jax.linear_util as lu
+import jax.numpy as jnp
+from jax.tree_util import PyTreeDef, tree_flatten, tree_structure, tree_unflatten
+
+from jax._src.config import config
+from jax._src.util import prod, safe_map as map, safe_zip as zip
+
+
+ArrayLike = Any
+
+# Shapes contributed by each leaf along one logical dimension, e.g.,
+# ``((2, 3), (4,))`` for a dimension of logical size 10 split over two leaves.
+AxisShapes = Tuple[Tuple[int, ...], ...]
+LeafShapes = List[AxisShapes]
+# Array blocks keyed by one leaf index per logical dimension. These dicts are
+# always built in lexicographic coordinate order, so ``leaves.values()`` is a
+# flat, contiguous view of the blocks that can be indexed via _coord_to_index
+# without hashing coordinate tuples.
+Leaves = Dict[Tuple[int, ...], ArrayLike]
+
+TRIVIAL_TREEDEF = tree_structure(1)
+
+
+def _canonical_treedef(treedef: PyTreeDef) -> PyTreeDef:
+  # every trivial treedef stored on a TreeTracer is the TRIVIAL_TREEDEF
+  # singleton, so the rules below can test for it with ``is`` instead of a
+  # structural comparison; canonicalize at the boundaries where treedefs
+  # enter from user pytrees
+  return TRIVIAL_TREEDEF if treedef == TRIVIAL_TREEDEF else treedef
+
+
+def is_trivial_axis(treedef: PyTreeDef, leafshapes: AxisShapes) -> bool:
+  return treedef is TRIVIAL_TREEDEF and len(leafshapes) == 1
+
+
+# interning table for per-axis shape tuples: handing out one canonical
+# instance per distinct value lets the equality and set-membership checks in
+# the rules short-circuit on object identity
+_SHAPE_CACHE: Dict[AxisShapes, AxisShapes] = {}
+
+
+def _intern_shapes(shapes: AxisShapes) -> AxisShapes:
+  return _SHAPE_CACHE.setdefault(shapes, shapes)
+
+
+@functools.lru_cache(maxsize=None)
+def _cached_coords(num_leaves: Tuple[int, ...]) -> Tuple[Tuple[int, ...], ...]:
+  # itertools.product builds the coordinate tuples entirely in C; repeated
+  # structures (ubiquitous across the binds of one traced function) hit the
+  # cache and share one materialized tuple
+  return tuple(it.product(*map(range, num_leaves)))
+
+
+def _iter_leaf_coords(treedefs) -> Tuple[Tuple[int, ...], ...]:
+  # returns a memoized tuple, so rules can bind the result once per entry
+  # and iterate it repeatedly without re-walking the product
+  return _cached_coords(tuple(treedef.num_leaves for treedef in treedefs))
+
+
+def _iter_leaf_coords2(leafshapes) -> Tuple[Tuple[int, ...], ...]:
+  return _cached_coords(tuple(len(shapes) for shapes in leafshapes))
+
+
+@functools.lru_cache(maxsize=None)
+def _strides(num_leaves: Tuple[int, ...]) -> Tuple[int, ...]:
+  """Row-major strides for indexing the flat view of a leaves dict."""
+  strides = []
+  stride = 1
+  for n in reversed(num_leaves):
+    strides.append(stride)
+    stride *= n
+  return tuple(reversed(strides))
+
+
+def _coord_to_index(coords: Tuple[int, ...], strides: Tuple[int, ...]) -> int:
+  return sum(coord * stride for coord, stride in zip(coords, strides))
+
+
+def _coord_getter(indices: Tuple[int, ...]) -> Callable:
+  """Returns a callable selecting ``indices`` from a coords tuple, as a tuple.
+
+  itemgetter runs in C but returns a bare element for a single index, so the
+  short cases are wrapped to always produce tuples.
+  """
+  if not indices:
+    return lambda coords: ()
+  if len(indices) == 1:
+    index, = indices
+    return lambda coords: (coords[index],)
+  return operator.itemgetter(*indices)
+
+
+def _axis_length(shapes: AxisShapes) -> int:
+  return sum(prod(shape) for shape in shapes)
+
+
+def _leafshape(leafshapes: LeafShapes, coords: Tuple[int, ...]) -> Tuple[int, ...]:
+  # for the few axes seen here, plain tuple addition beats generator plus
+  # chain.from_iterable machinery
+  shape = ()
+  for shapes, i in zip(leafshapes, coords):
+    shape += shapes[i]
+  return shape
+
+
+def _axes_for_leaf(leafshapes: Sequence[AxisShapes], coords: Tuple[int, ...],
+                   axes: Sequence[int]) -> Tuple[int, ...]:
+  """Maps logical ``axes`` into dimensions of the leaf at ``coords``.
+
+  Always returns a tuple, so results can be passed straight into primitive
+  parameters without re-wrapping.
+  """
+  # called from inside per-leaf loops in every rule, so memoize on the
+  # (hashable) structure rather than recomputing the offsets each time
+  shapes_key = leafshapes if isinstance(leafshapes, tuple) else tuple(leafshapes)
+  axes_key = axes if isinstance(axes, tuple) else tuple(axes)
+  return _axes_for_leaf_cached(shapes_key, coords, axes_key)
+
+
+@functools.lru_cache(maxsize=4096)
+def _axes_for_leaf_cached(leafshapes: Tuple[AxisShapes, ...],
+                          coords: Tuple[int, ...],
+                          axes: Tuple[int, ...]) -> Tuple[int, ...]:
+  offsets = []
+  offset = 0
+  for shapes, coord in zip(leafshapes, coords):
+    offsets.append(offset)
+    offset += len(shapes[coord])
+  out = []
+  for axis in axes:
+    ndim = len(leafshapes[axis][coords[axis]])
+    out.extend(range(offsets[axis], offsets[axis] + ndim))
+  return tuple(out)
+
+
+def _vectorized_tree_data(
+    xs, treedef: PyTreeDef) -> Tuple[List[PyTreeDef], LeafShapes, Leaves]:
+  dtype = jnp.result_type(*xs)
+  leafshapes: LeafShapes = [_intern_shapes(tuple(np.shape(x) for x in xs))]
+  leaves: Leaves = {(i,): jnp.asarray(x, dtype) for i, x in enumerate(xs)}
+  return [_canonical_treedef(treedef)], leafshapes, leaves
+
+
+def convert_vectorized_tree(tree) -> Tuple[List[PyTreeDef], LeafShapes, Leaves]:
+  """Converts a pytree into the data for a rank-1 tree vector."""
+  xs, treedef = tree_flatten(tree)
+  return _vectorized_tree_data(xs, treedef)
+
+
+def convert_leaf_array(leaf) -> Tuple[List[PyTreeDef], LeafShapes, Leaves]:
+  """Converts an ordinary array into tree vector data with trivial treedefs."""
+  treedef = tree_structure(leaf)
+  if treedef != TRIVIAL_TREEDEF:
+    raise ValueError(
+        f"argument to convert_leaf_array must be a leaf, got {treedef}")
+  ndim = np.ndim(leaf)
+  treedefs = [TRIVIAL_TREEDEF] * ndim
+  leafshapes: LeafShapes = [_intern_shapes(((s,),)) for s in np.shape(leaf)]
+  leaves: Leaves = {(0,) * ndim: leaf}
+  return treedefs, leafshapes, leaves
+
+
+def restore_tree(treedefs: List[PyTreeDef], leaves: Leaves):
+  """Converts tree vector data back into a (possibly nested) pytree."""
+  if not treedefs:
+    return leaves[()]
+  # the leaves dict is ordered lexicographically by coordinate, which is
+  # exactly the depth-first order of the nested tree, so a single pass over
+  # the values suffices -- no per-axis intermediate dicts
+  leaves_iter = iter(leaves.values())
+  ndim = len(treedefs)
+
+  def build(depth: int):
+    treedef = treedefs[depth]
+    if depth + 1 == ndim:
+      children = [next(leaves_iter) for _ in range(treedef.num_leaves)]
+    else:
+      children = [build(depth + 1) for _ in range(treedef.num_leaves)]
+    return tree_unflatten(treedef, children)
+
+  return build(0)
+
+
+class TreeTracer(core.Tracer):
+  __slots__ = ["treedefs", "leafshapes", "leaves"]
+
+  treedefs: List[PyTreeDef]
+  leafshapes: LeafShapes
+  leaves: Leaves
+
+  def __init__(self, trace, treedefs, leafshapes, leaves):
+    if config.jax_enable_checks:
+      # internal invariants; O(#leaves) per tracer, so only checked on demand
+      assert len(treedefs) == len(leafshapes)
+      assert leaves
+      assert tuple(leaves) == _iter_leaf_coords(treedefs)
+      for coords in _iter_leaf_coords(treedefs):
+        expected_shape = _leafshape(leafshapes, coords)
+        actual_shape = np.shape(leaves[coords])
+        assert actual_shape == expected_shape, (actual_shape, expected_shape)
+    self._trace = trace
+    self.treedefs = list(treedefs)
+    self.leafshapes = list(leafshapes)
+    self.leaves = leaves
+
+  @property
+  def aval(self):
+    shape = tuple(map(_axis_length, self.leafshapes))
+    leaf = next(iter(self.leaves.values()))
+    leaf_aval = core.raise_to_shaped(core.get_aval(leaf))
+    return core.ShapedArray(shape, leaf_aval.dtype, leaf_aval.weak_type)
+
+  def full_lower(self):
+    return self
+
+
+class TreeTrace(core.Trace):
+
+  def pure(self, val):
+    # constants are broadcast against the tree structure of other arguments
+    return TreeTracer(self, *convert_leaf_array(val))
+
+  def lift(self, tracer):
+    return TreeTracer(self, *convert_leaf_array(tracer))
+
+  def sublift(self, tracer):
+    return TreeTracer(self, tracer.treedefs, tracer.leafshapes, tracer.leaves)
+
+  def process_primitive(self, primitive, tracers, params):
+    if all(all(td is TRIVIAL_TREEDEF and len(ls) == 1 and len(ls[0]) == 1
+               for td, ls in zip(t.treedefs, t.leafshapes))
+           for t in tracers):
+      # no tree structure anywhere: bind directly on the underlying arrays
+      # instead of running a rule's splitting and broadcasting machinery.
+      # each axis must also hold a rank-1 piece, so the tracer round-trips
+      # exactly through convert_leaf_array; a trivial axis backed by a
+      # higher-rank piece (e.g. a bare 2D array argument) still needs the
+      # rules' logical-to-leaf axis mapping.
+      # because this check runs before dispatch, the rules themselves never
+      # see all-trivial operands and need no trivial fast paths of their own
+      vals = [next(iter(t.leaves.values())) for t in tracers]
+      out = primitive.bind(*vals, **params)
+      if primitive.multiple_results:
+        return [TreeTracer(self, *convert_leaf_array(x)) for x in out]
+      return TreeTracer(self, *convert_leaf_array(out))
+    rule = _tree_rules_get(primitive)
+    if rule is None:
+      raise NotImplementedError(
+          f"no tree vectorization rule for {primitive}")
+    # one explicit pass over the tracers beats unzip3's generator machinery
+    # in this hot path
+    treedefs_in = []
+    leafshapes_in = []
+    leaves_in = []
+    for t in tracers:
+      treedefs_in.append(t.treedefs)
+      leafshapes_in.append(t.leafshapes)
+      leaves_in.append(t.leaves)
+    result = rule(treedefs_in, leafshapes_in, leaves_in, **params)
+    if primitive.multiple_results:
+      return [TreeTracer(self, td, ls, lv) for td, ls, lv in result]
+    else:
+      return TreeTracer(self, *result)
+
+  def process_call(self, call_primitive, f, tracers, params):
+    leaves_in, structures = _flatten_tree_tracers(tracers)
+    f_tree, out_structures = _tree_call_subtrace(f, self.main, structures)
+    new_params = dict(params)
+    if "donated_invars" in new_params:
+      new_params["donated_invars"] = (False,) * len(leaves_in)
+    leaves_out = call_primitive.bind(f_tree, *leaves_in, **new_params)
+    return _unflatten_tree_tracers(self, out_structures(), leaves_out)
+
+
+@lu.transformation_with_aux
+def _tree_call_subtrace(main, structures, *leaves_flat):
+  trace = TreeTrace(main, core.cur_sublevel())
+  in_tracers = _unflatten_tree_tracers(trace, structures, leaves_flat)
+  outs = yield in_tracers, {}
+  out_tracers = map(trace.full_raise, outs)
+  leaves_out, out_structures = _flatten_tree_tracers(out_tracers)
+  yield leaves_out, out_structures
+
+
+def _flatten_tree_tracers(tracers):
+  """Flattens the leaves of several tracers into one list, with structure."""
+  structures = []
+  leaves_flat = []
+  for t in tracers:
+    structures.append((tuple(t.treedefs), tuple(t.leafshapes)))
+    leaves_flat.extend(t.leaves.values())
+  return leaves_flat, tuple(structures)
+
+
+def _unflatten_tree_tracers(trace, structures, leaves_flat):
+  leaves_iter = iter(leaves_flat)
+  return [TreeTracer(trace, treedefs, leafshapes,
+                     {coords: next(leaves_iter)
+                      for coords in _iter_leaf_coords(treedefs)})
+          for treedefs, leafshapes in structures]
+
+
+def _trees_to_tree_tracers(trace, trees):
+  # flatten the whole argument tuple once instead of once per tree, then
+  # carve the combined leaves list back up by each child's num_leaves
+  all_leaves, tuple_def = tree_flatten(tuple(trees))
+  tracers = []
+  pos = 0
+  for treedef in tuple_def.children():
+    xs = all_leaves[pos:pos + treedef.num_leaves]
+    pos += treedef.num_leaves
+    tracers.append(TreeTracer(trace, *_vectorized_tree_data(xs, treedef)))
+  return tracers
+
+
+def _tree_tracers_to_trees(tracers):
+  return [restore_tree(t.treedefs, t.leaves) for t in tracers]
+
+
+def tree_vectorize(fun: Callable) -> Callable:
+  """Vectorizes ``fun`` over pytree arguments.
+
+  Args:
+    fun: a function written in terms of :mod:`jax.numpy` operations on
+      one-dimensional arrays, returning a single output.
+
+  Returns:
+    A wrapped version of ``fun`` that accepts arbitrary pytrees of arrays in
+    place of each one-dimensional array argument, treating each pytree as a
+    single logical vector whose entries are the (flattened) pytree leaves.
+  """
+  @functools.wraps(fun)
+  def wrapper(*args, **kwargs):
+    with core.new_main(TreeTrace) as main:
+      trace = TreeTrace(main, core.cur_sublevel())
+      in_tracers = _trees_to_tree_tracers(trace, args)
+      ans = fun(*in_tracers, **kwargs)
+      out_tracer = trace.full_raise(ans)
+      out_tree, = _tree_tracers_to_trees([out_tracer])
+      del main, trace, in_tracers, out_tracer
+    return out_tree
+  return wrapper
+
+
+def tree_jvp(fun: Callable, primals, tangents):
+  """Tree-vectorized analogue of :func:`jax.jvp`.
+
+  ``primals`` and ``tangents`` should be sequences of pytrees with matching
+  structure, each interpreted as a logical vector like in ``tree_vectorize``.
+  """
+  f = lu.wrap_init(partial(jax.jvp, fun))
+  with core.new_main(TreeTrace) as main:
+    out = _tree_jvp_subtrace(f, main).call_wrapped(primals, tangents)
+    del main
+  return out
+
+
+def _flatten_many(trees):
+  """Flattens several pytrees into one leaves list in a single pass."""
+  leaves = []
+  leaves_per_tree = []
+  treedefs = []
+  for tree in trees:
+    xs, treedef = tree_flatten(tree)
+    leaves.extend(xs)
+    leaves_per_tree.append(xs)
+    treedefs.append(treedef)
+  return leaves, leaves_per_tree, treedefs
+
+
+@lu.transformation
+def _tree_jvp_subtrace(main, primal_in_trees, tangent_in_trees):
+  trace = TreeTrace(main, core.cur_sublevel())
+  primal_in_list, primal_in_lists, primal_in_tdefs = _flatten_many(
+      primal_in_trees)
+  tangent_in_list, tangent_in_lists, tangent_in_tdefs = _flatten_many(
+      tangent_in_trees)
+  if primal_in_tdefs != tangent_in_tdefs:
+    raise ValueError("primal and tangent trees must have matching structure: "
+                     f"{primal_in_tdefs} vs {tangent_in_tdefs}")
+  dtype = jnp.result_type(*primal_in_list, *tangent_in_list)
+  primal_tracers = [
+      TreeTracer(trace, [_canonical_treedef(tdef)],
+                 [_intern_shapes(tuple(np.shape(x) for x in xs))],
+                 {(i,): jnp.asarray(x, dtype) for i, x in enumerate(xs)})
+      for xs, tdef in zip(primal_in_lists, primal_in_tdefs)]
+  tangent_tracers = [
+      TreeTracer(trace, [_canonical_treedef(tdef)],
+                 [_intern_shapes(tuple(np.shape(x) for x in xs))],
+                 {(i,): jnp.asarray(x, dtype) for i, x in enumerate(xs)})
+      for xs, tdef in zip(tangent_in_lists, tangent_in_tdefs)]
+  primal_out, tangent_out = yield (primal_tracers, tangent_tracers), {}
+  out_tracers = [trace.full_raise(primal_out), trace.full_raise(tangent_out)]
+  yield tuple(_tree_tracers_to_trees(out_tracers))
+
+
+def tree_vmap(fun: Callable) -> Callable:
+  """Tree-vectorized analogue of :func:`jax.vmap`.
+
+  Maps ``fun`` over a leading axis shared by every leaf of the input pytrees,
+  while treating the remaining tree structure like ``tree_vectorize`` does.
+  """
+  @functools.wraps(fun)
+  def wrapper(*args):
+    f = lu.wrap_init(jax.vmap(fun))
+    with core.new_main(TreeTrace) as main:
+      out = _tree_batch_subtrace(f, main).call_wrapped(args)
+      del main
+    return out
+  return wrapper
+
+
+@lu.transformation
+def _tree_batch_subtrace(main, in_trees):
+  trace = TreeTrace(main, core.cur_sublevel())
+  in_list, in_lists, in_tdefs = _flatten_many(in_trees)
+  sizes = {np.shape(x)[0] for x in in_list}
+  if len(sizes) != 1:
+    raise ValueError(f"inconsistent leading axis sizes: {sizes}")
+  size, = sizes
+  in_tracers = []
+  for xs, tdef in zip(in_lists, in_tdefs):
+    dtype = jnp.result_type(*xs)
+    treedefs = [TRIVIAL_TREEDEF, _canonical_treedef(tdef)]
+    leafshapes = [_intern_shapes(((size,),)),
+                  _intern_shapes(tuple(np.shape(x)[1:] for x in xs))]
+    leaves = {(0, i): jnp.asarray(x, dtype) for i, x in enumerate(xs)}
+    in_tracers.append(TreeTracer(trace, treedefs, leafshapes, leaves))
+  ans = yield in_tracers, {}
+  out_tracer = trace.full_raise(ans)
+  out_tree, = _tree_tracers_to_trees([out_tracer])
+  yield out_tree
+
+
+### primitive rules
+
+tree_rules: Dict[core.Primitive, Callable] = {}
+
+# bound method, saving an attribute lookup on the dict per primitive bind
+_tree_rules_get = tree_rules.get
+
+
+@functools.lru_cache(maxsize=None)
+def _jit_stacked_reduce(prim, axes, params_items):
+  """Memoized jitted stack-and-reduce block.
+
+  The numerical work of combining a group of leaves is staged out once per
+  (primitive, axes, params) signature; repeated calls with the same leaf
+  shapes hit the jit cache and pay a single dispatch for the whole block.
+  """
+  params = dict(params_items)
+
+  @jax.jit
+  def stacked_reduce(group):
+    return prim.bind(jnp.stack(group), axes=axes, **params)
+
+  return stacked_reduce
+
+
+@functools.lru_cache(maxsize=None)
+def _jit_stacked_dot(dimension_numbers, params_items):
+  """Memoized jitted stack-multiply-accumulate block for dot_general."""
+  params = dict(params_items)
+
+  @jax.jit
+  def stacked_dot(lhs_group, rhs_group):
+    return lax.dot_general_p.bind(jnp.stack(lhs_group), jnp.stack(rhs_group),
+                                  dimension_numbers=dimension_numbers,
+                                  **params)
+
+  return stacked_dot
+
+
+def vectorized_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, **params):
+  """Rule for univariate elementwise primitives."""
+  treedefs, = treedefs_in
+  leafshapes, = leafshapes_in
+  leaves, = leaves_in
+  # ``leaves`` is ordered like _iter_leaf_coords(treedefs), so this rule can
+  # run over the flat storage without touching coordinates at all
+  leaves_flat = list(leaves.values())
+  # stack leaves that share a shape and bind once per group: one jaxpr
+  # equation (and one fused XLA kernel) instead of one per leaf
+  groups = collections.defaultdict(list)
+  for index, leaf in enumerate(leaves_flat):
+    groups[np.shape(leaf)].append(index)
+  out_flat = [None] * len(leaves_flat)
+  for indices in groups.values():
+    if len(indices) == 1:
+      index, = indices
+      out_flat[index] = prim.bind(leaves_flat[index], **params)
+    else:
+      stacked = jnp.stack([leaves_flat[index] for index in indices])
+      outs = prim.bind(stacked, **params)
+      for i, index in enumerate(indices):
+        out_flat[index] = lax.index_in_dim(outs, i, axis=0, keepdims=False)
+  out_leaves = dict(zip(_iter_leaf_coords(treedefs), out_flat))
+  return treedefs, leafshapes, out_leaves
+
+
+def defvectorized(prim):
+  tree_rules[prim] = partial(vectorized_tree_rule, prim)
+
+
+def _filter_scalar_leaves(treedefs_in, leafshapes_in, leaves_in):
+  """Pulls out rank-0 arguments, which mix freely with any tree structure."""
+  scalars = []
+  treedefs_out = []
+  leafshapes_out = []
+  leaves_out = []
+  for i, (treedefs, leafshapes, leaves) in enumerate(
+      zip(treedefs_in, leafshapes_in, leaves_in)):
+    if not treedefs:
+      scalars.append((i, leaves[()]))
+    else:
+      treedefs_out.append(treedefs)
+      leafshapes_out.append(leafshapes)
+      leaves_out.append(leaves)
+  return treedefs_out, leafshapes_out, leaves_out, scalars
+
+
+def _split_leaf(array, axis: int, offsets, sizes, shapes: AxisShapes):
+  """Slices ``array`` along dimension ``axis`` into one piece per shape."""
+  if len(shapes) > 1 and all(shape == shapes[0] for shape in shapes[1:]):
+    # uniform pieces: one reshape exposes the piece index as a leading
+    # dimension of the axis, so no strided slicing of the data is needed
+    new_shape = (array.shape[:axis] + (len(shapes),) + tuple(shapes[0])
+                 + array.shape[axis+1:])
+    reshaped = lax.reshape(array, new_shape)
+    return [lax.index_in_dim(reshaped, i, axis, keepdims=False)
+            for i in range(len(shapes))]
+  outs = []
+  for offset, size, shape in zip(offsets, sizes, shapes):
+    if size == array.shape[axis]:
+      piece = array
+    else:
+      piece = lax.slice_in_dim(array, offset, offset + size, axis=axis)
+    out_shape = array.shape[:axis] + tuple(shape) + array.shape[axis+1:]
+    outs.append(lax.reshape(piece, out_shape))
+  return outs
+
+
+def _split_leaves(leafshapes, leaves, axis: int, shapes: AxisShapes):
+  """Splits a trivial logical axis into per-leaf pieces matching ``shapes``."""
+  if len(leafshapes[axis]) != 1:
+    raise ValueError(f"can only split a trivial axis, got {leafshapes[axis]}")
+  out_leafshapes = list(leafshapes)
+  out_leafshapes[axis] = _intern_shapes(tuple(shapes))
+  # the slice boundaries are the same for every leaf; compute them once
+  sizes = [prod(shape) for shape in shapes]
+  offsets = list(it.accumulate([0] + sizes[:-1]))
+  out_leaves = {}
+  for in_coords in _iter_leaf_coords2(leafshapes):
+    leaf_dim, = _axes_for_leaf(leafshapes, in_coords, (axis,))
+    pieces = _split_leaf(leaves[in_coords], leaf_dim, offsets, sizes, shapes)
+    for i, piece in enumerate(pieces):
+      out_coords = in_coords[:axis] + (i,) + in_coords[axis+1:]
+      out_leaves[out_coords] = piece
+  # restore the canonical lexicographic ordering of the leaves dict
+  out_leaves = {coords: out_leaves[coords]
+                for coords in _iter_leaf_coords2(out_leafshapes)}
+  return out_leafshapes, out_leaves
+
+
+def naryop_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, **params):
+  """Rule for n-ary elementwise primitives with broadcasting."""
+  treedefs_in, leafshapes_in, leaves_in, scalars = _filter_scalar_leaves(
+      treedefs_in, leafshapes_in, leaves_in)
+  if not treedefs_in:
+    args = [leaf for _, leaf in scalars]
+    return [], [], {(): prim.bind(*args, **params)}
+  if (all(treedefs == treedefs_in[0] for treedefs in treedefs_in[1:])
+      and all(leafshapes == leafshapes_in[0]
+              for leafshapes in leafshapes_in[1:])):
+    # the dominant case: every operand already has the same structure, so the
+    # leaf blocks line up and no splitting or broadcasting is needed
+    leaves_flat_in = [list(leaves.values()) for leaves in leaves_in]
+    out_leaves = {}
+    for index, coords in enumerate(_iter_leaf_coords(treedefs_in[0])):
+      args = [leaves_flat[index] for leaves_flat in leaves_flat_in]
+      for i, scalar in scalars:
+        args.insert(i, scalar)
+      out_leaves[coords] = prim.bind(*args, **params)
+    return treedefs_in[0], leafshapes_in[0], out_leaves
+  ndim, = {len(treedefs) for treedefs in treedefs_in}
+  out_treedefs = []
+  out_leafshapes = []
+  for axis in range(ndim):
+    # every non-trivial structure along this axis must agree
+    non_trivial_treedefs = {treedefs[axis] for treedefs in treedefs_in
+                            if treedefs[axis] is not TRIVIAL_TREEDEF}
+    non_trivial_shapes = {leafshapes[axis] for leafshapes in leafshapes_in
+                          if len(leafshapes[axis]) != 1}
+    if len(non_trivial_treedefs) > 1:
+      raise ValueError(
+          f"conflicting treedefs along axis={axis}: {non_trivial_treedefs}")
+    if len(non_trivial_shapes) > 1:
+      raise ValueError(
+          f"conflicting leaf shapes along axis={axis}: {non_trivial_shapes}")
+    if non_trivial_treedefs:
+      treedef, = non_trivial_treedefs
+      out_treedefs.append(treedef)
+    else:
+      out_treedefs.append(TRIVIAL_TREEDEF)
+    if non_trivial_shapes:
+      shapes, = non_trivial_shapes
+      out_leafshapes.append(_intern_shapes(shapes))
+    else:
+      size = max(_axis_length(leafshapes[axis])
+                 for leafshapes in leafshapes_in)
+      out_leafshapes.append(_intern_shapes(((size,),)))
+  # split trivial axes so that the leaves of each argument line up with the
+  # leaves of the output; a split is only needed when the output has multiple
+  # pieces along the axis -- single-piece mismatches and broadcasts are
+  # handled by the reshape below without moving any data
+  leafshapes_fixed = []
+  leaves_fixed = []
+  for leafshapes, leaves in zip(leafshapes_in, leaves_in):
+    leafshapes = list(leafshapes)
+    for axis in range(ndim):
+      if (len(out_leafshapes[axis]) > 1
+          and leafshapes[axis] != out_leafshapes[axis]
+          and _axis_length(leafshapes[axis]) != 1):
+        leafshapes, leaves = _split_leaves(
+            leafshapes, leaves, axis, out_leafshapes[axis])
+    leafshapes_fixed.append(leafshapes)
+    leaves_fixed.append(leaves)
+  # per-operand data that does not depend on the output coordinate: the flat
+  # leaf storage, its strides, which axes have several pieces, and which axes
+  # this operand broadcasts along (rank aligned with size-1 dimensions)
+  ones_shapes = [tuple((1,) * len(shape) for shape in shapes)
+                 for shapes in out_leafshapes]
+  per_operand = []
+  for leafshapes, leaves in zip(leafshapes_fixed, leaves_fixed):
+    strides = _strides(tuple(len(shapes) for shapes in leafshapes))
+    multi = tuple(len(shapes) != 1 for shapes in leafshapes)
+    bcast = tuple(len(shapes) == 1 and _axis_length(shapes) == 1
+                  for shapes in leafshapes)
+    per_operand.append(
+        (leafshapes, list(leaves.values()), strides, multi, bcast))
+  out_leaves = {}
+  for out_coords in _iter_leaf_coords(out_treedefs):
+    args = []
+    for leafshapes, leaves_flat, strides, multi, bcast in per_operand:
+      in_coords = tuple(coord if multi[axis] else 0
+                        for axis, coord in enumerate(out_coords))
+      leaf = leaves_flat[_coord_to_index(in_coords, strides)]
+      # align leaf ranks with the output leaf, relying on the size-1
+      # broadcasting built into lax's n-ary ops for broadcast axes; a single
+      # reshape emits one equation where squeeze + expand_dims would emit two
+      target_shape = []
+      needs_reshape = False
+      for axis, out_coord in enumerate(out_coords):
+        in_shape = leafshapes[axis][in_coords[axis]]
+        if bcast[axis]:
+          out_shape = ones_shapes[axis][out_coord]
+        else:
+          out_shape = out_leafshapes[axis][out_coord]
+        if out_shape != in_shape:
+          needs_reshape = True
+        target_shape.extend(out_shape)
+      if needs_reshape:
+        leaf = lax.reshape(leaf, tuple(target_shape))
+      args.append(leaf)
+    for i, scalar in scalars:
+      args.insert(i, scalar)
+    out_leaves[out_coords] = prim.bind(*args, **params)
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+def defnaryop(prim):
+  tree_rules[prim] = partial(naryop_tree_rule, prim)
+
+
+def concatenate_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, *,
+                          dimension):
+  for treedefs in treedefs_in:
+    if treedefs[dimension] is not TRIVIAL_TREEDEF:
+      raise NotImplementedError(
+          "concatenation along a non-trivial tree dimension")
+  for leafshapes in leafshapes_in:
+    if len(leafshapes[dimension]) != 1 or len(leafshapes[dimension][0]) != 1:
+      raise NotImplementedError(
+          f"concatenation along a split dimension: {leafshapes[dimension]}")
+  treedefs = treedefs_in[0]
+  ndim = len(treedefs)
+  for axis in range(ndim):
+    if axis != dimension:
+      for other_treedefs, other_leafshapes in zip(treedefs_in[1:],
+                                                  leafshapes_in[1:]):
+        if (other_treedefs[axis] != treedefs[axis]
+            or other_leafshapes[axis] != leafshapes_in[0][axis]):
+          raise ValueError(f"conflicting structure along axis={axis}")
+  out_treedefs = list(treedefs)
+  out_leafshapes = list(leafshapes_in[0])
+  size = sum(_axis_length(leafshapes[dimension])
+             for leafshapes in leafshapes_in)
+  out_leafshapes[dimension] = _intern_shapes(((size,),))
+  out_leaves = {
+      coords: prim.bind(
+          *[leaves[coords] for leaves in leaves_in],
+          dimension=_axes_for_leaf(out_leafshapes, coords, (dimension,))[0])
+      for coords in _iter_leaf_coords(out_treedefs)}
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+def broadcast_in_dim_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, *,
+                               shape, broadcast_dimensions):
+  treedefs, = treedefs_in
+  leafshapes, = leafshapes_in
+  leaves, = leaves_in
+  out_treedefs = [TRIVIAL_TREEDEF] * len(shape)
+  out_leafshapes: LeafShapes = [_intern_shapes(((s,),)) for s in shape]
+  for in_axis, out_axis in enumerate(broadcast_dimensions):
+    if _axis_length(leafshapes[in_axis]) == shape[out_axis]:
+      out_treedefs[out_axis] = treedefs[in_axis]
+      out_leafshapes[out_axis] = leafshapes[in_axis]
+    elif not is_trivial_axis(treedefs[in_axis], leafshapes[in_axis]):
+      raise ValueError(
+          f"cannot resize tree dimension {in_axis} to size {shape[out_axis]}")
+  out_leaves = {}
+  for out_coords in _iter_leaf_coords(out_treedefs):
+    in_coords = tuple(out_coords[out_axis]
+                      for out_axis in broadcast_dimensions)
+    leaf = leaves[in_coords]
+    leaf_shape = _leafshape(out_leafshapes, out_coords)
+    leaf_bdims = []
+    for in_axis, out_axis in enumerate(broadcast_dimensions):
+      out_dims = _axes_for_leaf(out_leafshapes, out_coords, (out_axis,))
+      in_ndim = len(leafshapes[in_axis][in_coords[in_axis]])
+      if in_ndim == len(out_dims):
+        leaf_bdims.extend(out_dims)
+      else:
+        # a rank-0 leaf broadcasts against the whole output dimension
+        assert in_ndim == 0
+    out_leaves[out_coords] = prim.bind(leaf, shape=leaf_shape,
+                                       broadcast_dimensions=tuple(leaf_bdims))
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+def squeeze_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, *,
+                      dimensions):
+  treedefs, = treedefs_in
+  leafshapes, = leafshapes_in
+  leaves, = leaves_in
+  for axis in dimensions:
+    if not is_trivial_axis(treedefs[axis], leafshapes[axis]):
+      raise ValueError(f"cannot squeeze tree dimension {axis}")
+  dims = tuple(dimensions)
+  dims_set = set(dimensions)
+  keep_idx = tuple(i for i in range(len(treedefs)) if i not in dims_set)
+  out_treedefs = [treedefs[i] for i in keep_idx]
+  out_leafshapes = [leafshapes[i] for i in keep_idx]
+  out_leaves = {
+      tuple(in_coords[i] for i in keep_idx):
+          prim.bind(leaves[in_coords],
+                    dimensions=_axes_for_leaf(leafshapes, in_coords, dims))
+      for in_coords in _iter_leaf_coords(treedefs)}
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+def transpose_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, *,
+                        permutation):
+  treedefs, = treedefs_in
+  leafshapes, = leafshapes_in
+  leaves, = leaves_in
+  perm = tuple(permutation)
+  out_treedefs = [treedefs[p] for p in perm]
+  out_leafshapes = [leafshapes[p] for p in perm]
+  # iterate over output coordinates so that out_leaves is built in
+  # lexicographic order
+  inverse = {p: axis for axis, p in enumerate(perm)}
+  ndim = len(treedefs)
+  out_coords_list = _iter_leaf_coords(out_treedefs)
+  in_coords_list = [tuple(out_coords[inverse[axis]] for axis in range(ndim))
+                    for out_coords in out_coords_list]
+  # transpose leaves that share a shape and per-leaf permutation as one
+  # stacked bind: one jaxpr equation per bucket instead of one per leaf
+  out_flat = [None] * len(out_coords_list)
+  buckets = collections.defaultdict(list)
+  for index, in_coords in enumerate(in_coords_list):
+    leaf_perm = _axes_for_leaf(leafshapes, in_coords, perm)
+    if leaf_perm == tuple(range(len(leaf_perm))):
+      # the permutation only moves whole leaves around; the leaf itself
+      # is untouched, so don't emit a transpose equation for it
+      out_flat[index] = leaves[in_coords]
+      continue
+    buckets[(np.shape(leaves[in_coords]), leaf_perm)].append(index)
+  for (_, leaf_perm), indices in buckets.items():
+    if len(indices) == 1:
+      index, = indices
+      out_flat[index] = prim.bind(leaves[in_coords_list[index]],
+                                  permutation=leaf_perm)
+    else:
+      stacked = jnp.stack([leaves[in_coords_list[i]] for i in indices])
+      outs = prim.bind(stacked,
+                       permutation=(0,) + tuple(p + 1 for p in leaf_perm))
+      for pos, index in enumerate(indices):
+        out_flat[index] = lax.index_in_dim(outs, pos, axis=0, keepdims=False)
+  out_leaves = dict(zip(out_coords_list, out_flat))
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+def reducer_tree_rule(prim):
+  """Returns the tree rule for an associative reduction primitive.
+
+  A closure over ``prim`` rather than a partial: the dispatch path then
+  calls the rule directly, with no argument re-packing in between.
+  """
+  bind = prim.bind
+
+  def rule(treedefs_in, leafshapes_in, leaves_in, *, axes, **params):
+    treedefs, = treedefs_in
+    leafshapes, = leafshapes_in
+    leaves, = leaves_in
+    reduce_axes = tuple(axes)
+    axes_set = set(axes)
+    keep_idx = tuple(i for i in range(len(treedefs)) if i not in axes_set)
+    out_treedefs = [treedefs[i] for i in keep_idx]
+    out_leafshapes = [leafshapes[i] for i in keep_idx]
+    # group by an integer id into a list of lists: one hash lookup per input
+    # leaf instead of dict-of-lists setdefault churn
+    out_coord_list = _iter_leaf_coords(out_treedefs)
+    coord_to_gid = {c: i for i, c in enumerate(out_coord_list)}
+    buckets = [[] for _ in out_coord_list]
+    for in_coords in _iter_leaf_coords(treedefs):
+      out_coords = tuple(in_coords[i] for i in keep_idx)
+      buckets[coord_to_gid[out_coords]].append(in_coords)
+    out_leaves = {}
+    for out_coords, group in zip(out_coord_list, buckets):
+      if len(group) == 1:
+        in_coords, = group
+        leaf_axes = _axes_for_leaf(leafshapes, in_coords, reduce_axes)
+        # with no leaf axes to reduce, the bind would be an identity
+        out_leaves[out_coords] = (
+            leaves[in_coords] if not leaf_axes
+            else bind(leaves[in_coords], axes=leaf_axes, **params))
+        continue
+      shapes = {np.shape(leaves[c]) for c in group}
+      perms = {_axes_for_leaf(leafshapes, c, reduce_axes) for c in group}
+      params_items = tuple(sorted(params.items()))
+      if len(shapes) == 1 and len(perms) == 1:
+        # the reduction is associative, so stacking the group and folding the
+        # stack axis into one bind is equivalent to reducing each leaf and
+        # combining the results pairwise -- and emits a single equation
+        leaf_axes, = perms
+        out_leaves[out_coords] = _jit_stacked_reduce(
+            prim, (0,) + tuple(a + 1 for a in leaf_axes), params_items)(
+                [leaves[c] for c in group])
+      else:
+        # the per-leaf reductions all have the output leaf's shape, so the
+        # combine step is one stacked reduction rather than a binop chain
+        reduced = []
+        for c in group:
+          leaf_axes = _axes_for_leaf(leafshapes, c, reduce_axes)
+          reduced.append(leaves[c] if not leaf_axes
+                         else bind(leaves[c], axes=leaf_axes, **params))
+        out_leaves[out_coords] = _jit_stacked_reduce(prim, (0,),
+                                                     params_items)(reduced)
+    return out_treedefs, out_leafshapes, out_leaves
+
+  return rule
+
+
+def defreducer(prim):
+  tree_rules[prim] = reducer_tree_rule(prim)
+
+
+def dot_general_tree_rule(prim, treedefs_in, leafshapes_in, leaves_in, *,
+                          dimension_numbers, **params):
+  lhs_treedefs, rhs_treedefs = treedefs_in
+  lhs_leafshapes, rhs_leafshapes = leafshapes_in
+  lhs_leaves, rhs_leaves = leaves_in
+  (lhs_contracting, rhs_contracting), (lhs_batch, rhs_batch) = \
+      dimension_numbers
+  lhs_contracting = tuple(lhs_contracting)
+  rhs_contracting = tuple(rhs_contracting)
+  batch = tuple(lhs_batch)
+  rhs_batch = tuple(rhs_batch)
+  for lhs_axis, rhs_axis in zip(lhs_contracting + batch,
+                                rhs_contracting + rhs_batch):
+    if (lhs_treedefs[lhs_axis] != rhs_treedefs[rhs_axis]
+        or lhs_leafshapes[lhs_axis] != rhs_leafshapes[rhs_axis]):
+      raise ValueError(
+          f"conflicting structure on contracted dimensions: {lhs_axis} vs "
+          f"{rhs_axis}")
+  lhs_used = set(lhs_contracting + batch)
+  rhs_used = set(rhs_contracting + rhs_batch)
+  lhs_remaining = tuple(i for i in range(len(lhs_treedefs))
+                        if i not in lhs_used)
+  rhs_remaining = tuple(i for i in range(len(rhs_treedefs))
+                        if i not in rhs_used)
+  lhs_out_axes = batch + lhs_remaining
+  out_treedefs = ([lhs_treedefs[i] for i in lhs_out_axes]
+                  + [rhs_treedefs[i] for i in rhs_remaining])
+  out_leafshapes = ([lhs_leafshapes[i] for i in lhs_out_axes]
+                    + [rhs_leafshapes[i] for i in rhs_remaining])
+  # interleave plan: for each rhs axis, whether its coordinate comes from
+  # the lhs (contracted/batch axes are shared) or from the rhs-remaining
+  # coordinates, and at which index
+  rhs_src = dict(zip(rhs_contracting + rhs_batch, lhs_contracting + batch))
+  rhs_plan = tuple(
+      (True, rhs_src[j]) if j in rhs_src
+      else (False, rhs_remaining.index(j))
+      for j in range(len(rhs_treedefs)))
+  lhs_coords_list = _iter_leaf_coords(lhs_treedefs)
+  rhs_nonbatch_coords_list = _cached_coords(
+      tuple(rhs_treedefs[i].num_leaves for i in rhs_remaining))
+  out_coord_list = _iter_leaf_coords(out_treedefs)
+  coord_to_gid = {c: i for i, c in enumerate(out_coord_list)}
+  buckets = [[] for _ in out_coord_list]
+  get_lhs_out = _coord_getter(lhs_out_axes)
+  get_rhs_out = _coord_getter(rhs_remaining)
+  for lhs_coords in lhs_coords_list:
+    lhs_out_coords = get_lhs_out(lhs_coords)
+    # these only depend on the lhs leaf, not on the inner iteration
+    leaf_lhs_contracting = _axes_for_leaf(
+        lhs_leafshapes, lhs_coords, lhs_contracting)
+    leaf_batch = _axes_for_leaf(lhs_leafshapes, lhs_coords, batch)
+    for rhs_nonbatch_coords in rhs_nonbatch_coords_list:
+      rhs_coords = tuple(
+          lhs_coords[src] if is_lhs else rhs_nonbatch_coords[src]
+          for is_lhs, src in rhs_plan)
+      leaf_rhs_contracting = _axes_for_leaf(
+          rhs_leafshapes, rhs_coords, rhs_contracting)
+      if config.jax_enable_checks:
+        assert leaf_batch == _axes_for_leaf(
+            rhs_leafshapes, rhs_coords, rhs_batch)
+      leaf_dims = ((leaf_lhs_contracting, leaf_rhs_contracting),
+                   (leaf_batch, leaf_batch))
+      out_coords = lhs_out_coords + get_rhs_out(rhs_coords)
+      buckets[coord_to_gid[out_coords]].append(
+          (lhs_leaves[lhs_coords], rhs_leaves[rhs_coords], leaf_dims))
+  out_leaves = {}
+  for coords, pairs in zip(out_coord_list, buckets):
+    if len(pairs) == 1:
+      (lhs_leaf, rhs_leaf, leaf_dims), = pairs
+      out_leaves[coords] = prim.bind(lhs_leaf, rhs_leaf,
+                                     dimension_numbers=leaf_dims, **params)
+      continue
+    dims_set = {leaf_dims for _, _, leaf_dims in pairs}
+    lhs_shapes = {np.shape(lhs_leaf) for lhs_leaf, _, _ in pairs}
+    rhs_shapes = {np.shape(rhs_leaf) for _, rhs_leaf, _ in pairs}
+    if len(dims_set) == 1 and len(lhs_shapes) == 1 and len(rhs_shapes) == 1:
+      # stack both operands and contract the stack axis as well: one GEMM
+      # that multiplies and accumulates, instead of a dot per pair followed
+      # by a chain of adds over the partial products
+      ((lc, rc), (lb, rb)), = dims_set
+      stacked_dims = ((tuple(a + 1 for a in lc) + (0,),
+                       tuple(a + 1 for a in rc) + (0,)),
+                      (tuple(b + 1 for b in lb), tuple(b + 1 for b in rb)))
+      out_leaves[coords] = _jit_stacked_dot(
+          stacked_dims, tuple(sorted(params.items())))(
+              [lhs_leaf for lhs_leaf, _, _ in pairs],
+              [rhs_leaf for _, rhs_leaf, _ in pairs])
+    else:
+      # every partial product has the output leaf's shape, so summing them
+      # is one stacked reduction instead of a chain of adds
+      nodes = [prim.bind(lhs_leaf, rhs_leaf, dimension_numbers=leaf_dims,
+                         **params)
+               for lhs_leaf, rhs_leaf, leaf_dims in pairs]
+      out_leaves[coords] = _jit_stacked_reduce(lax.reduce_sum_p, (0,),
+                                               ())(nodes)
+  return out_treedefs, out_leafshapes, out_leaves
+
+
+defvectorized(lax.neg_p)
+defvectorized(lax.sign_p)
+defvectorized(lax.floor_p)
+defvectorized(lax.ceil_p)
+defvectorized(lax.round_p)
+defvectorized(lax.is_finite_p)
+defvectorized(lax.exp_p)
+defvectorized(lax.log_p)
+defvectorized(lax.expm1_p)
+defvectorized(lax.log1p_p)
+defvectorized(lax.sin_p)
+defvectorized(lax.cos_p)
+defvectorized(lax.tan_p)
+defvectorized(lax.asin_p)
+defvectorized(lax.acos_p)
+defvectorized(lax.atan_p)
+defvectorized(lax.sinh_p)
+defvectorized(lax.cosh_p)
+defvectorized(lax.tanh_p)
+defvectorized(lax.asinh_p)
+defvectorized(lax.acosh_p)
+defvectorized(lax.atanh_p)
+defvectorized(lax.sqrt_p)
+defvectorized(lax.rsqrt_p)
+defvectorized(lax.cbrt_p)
+defvectorized(lax.abs_p)
+defvectorized(lax.not_p)
+defvectorized(lax.erf_p)
+defvectorized(lax.erfc_p)
+defvectorized(lax.erf_inv_p)
+defvectorized(lax.integer_pow_p)
+defvectorized(lax.convert_element_type_p)
+defvectorized(lax.real_p)
+defvectorized(lax.imag_p)
+
+defnaryop(lax.add_p)
+defnaryop(lax.sub_p)
+defnaryop(lax.mul_p)
+defnaryop(lax.div_p)
+defnaryop(lax.rem_p)
+defnaryop(lax.max_p)
+defnaryop(lax.min_p)
+defnaryop(lax.pow_p)
+defnaryop(lax.atan2_p)
+defnaryop(lax.nextafter_p)
+defnaryop(lax.and_p)
+defnaryop(lax.or_p)
+defnaryop(lax.xor_p)
+defnaryop(lax.shift_left_p)
+defnaryop(lax.shift_right_arithmetic_p)
+defnaryop(lax.shift_right_logical_p)
+defnaryop(lax.eq_p)
+defnaryop(lax.ne_p)
+defnaryop(lax.ge_p)
+defnaryop(lax.gt_p)
+defnaryop(lax.le_p)
+defnaryop(lax.lt_p)
+defnaryop(lax.select_n_p)
+
+tree_rules[lax.concatenate_p] = partial(concatenate_tree_rule,
+                                        lax.concatenate_p)
+tree_rules[lax.broadcast_in_dim_p] = partial(broadcast_in_dim_tree_rule,
+                                             lax.broadcast_in_dim_p)
+tree_rules[lax.squeeze_p] = partial(squeeze_tree_rule, lax.squeeze_p)
+tree_rules[lax.transpose_p] = partial(transpose_tree_rule, lax.transpose_p)
+tree_rules[lax.dot_general_p] = partial(dot_general_tree_rule,
+                                        lax.dot_general_p)
+
+defreducer(lax.reduce_sum_p)
+defreducer(lax.reduce_prod_p)
+defreducer(lax.reduce_max_p)
+defreducer(lax.reduce_min_p)
+defreducer(lax.reduce_or_p)
+defreducer(lax.reduce_and_p)